@@ -1,13 +1,26 @@
 #!/usr/bin/env python3
 
+import os
 import sys
-import re
 import json
-from collections import defaultdict
+from array import array
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
 from pathlib import Path
 
+import requests
 import spotipy
+from requests.adapters import HTTPAdapter
 from spotipy.oauth2 import SpotifyOAuth
+from urllib3.util.retry import Retry
+
+try:
+    import orjson  # optional: faster cache file serialization
+except ImportError:
+    orjson = None
 
 # Default cutoff year – you will be asked and can override this
 DEFAULT_CUTOFF_YEAR = 1992
@@ -15,6 +28,23 @@ DEFAULT_CUTOFF_YEAR = 1992
 # Duration threshold for automatic duplicate cleanup (in seconds)
 DUP_DURATION_THRESHOLD_SEC = 3
 
+# Number of concurrent requests when fetching paginated playlist data
+FETCH_WORKERS = 8
+
+# Number of concurrent removal requests when deleting duplicates
+REMOVE_WORKERS = 4
+
+# HTTP connection pool shared by the (concurrent) Spotify API calls
+HTTP_POOL_SIZE = 16
+REQUEST_TIMEOUT_SEC = 10
+
+# Only request the track fields this script reads (skips available_markets etc.)
+TRACK_FIELDS = (
+    "total,"
+    "items(track(id,uri,name,duration_ms,artists(name),"
+    "album(name,release_date,release_date_precision)))"
+)
+
 # Scopes: read playlist + modify it
 SCOPE = (
     "playlist-read-private "
@@ -24,67 +54,198 @@ SCOPE = (
 )
 
 # Simple JSON file to remember which tracks you chose to keep (by track ID)
+# and the normalized title/artist computed for each track ID
 CACHE_PATH = Path("playlist_refiner_cache.json")
 
+# Bump when normalize_title/normalize_artist change, so cached keys made by
+# older rules are thrown away instead of grouping tracks the old way
+NORM_CACHE_VERSION = 1
+
+# Spotify track IDs are fixed-length base62 strings, so kept IDs are stored
+# as one concatenated string instead of a list of separate JSON strings
+SPOTIFY_ID_LEN = 22
+
 
 # ---------- Cache helpers ----------
 
+def new_decision_cache():
+    return {
+        "keep": [],
+        "keep_blob": "",
+        "norm": {},
+        "norm_version": NORM_CACHE_VERSION,
+    }
+
+
 def load_decision_cache():
     if CACHE_PATH.is_file():
         try:
-            with CACHE_PATH.open("r", encoding="utf-8") as f:
-                data = json.load(f)
+            if orjson is not None:
+                data = orjson.loads(CACHE_PATH.read_bytes())
+            else:
+                with CACHE_PATH.open("r", encoding="utf-8") as f:
+                    data = json.load(f)
             if not isinstance(data, dict):
-                return {"keep": []}
+                return new_decision_cache()
             data.setdefault("keep", [])
+            blob = data.get("keep_blob")
+            if not isinstance(blob, str) or len(blob) % SPOTIFY_ID_LEN:
+                data["keep_blob"] = ""
+            if (
+                not isinstance(data.get("norm"), dict)
+                or data.get("norm_version") != NORM_CACHE_VERSION
+            ):
+                data["norm"] = {}
+                data["norm_version"] = NORM_CACHE_VERSION
+            else:
+                # Interned like the track IDs from get_all_tracks
+                intern = sys.intern
+                data["norm"] = {intern(k): v for k, v in data["norm"].items()}
             return data
         except Exception:
-            return {"keep": []}
-    return {"keep": []}
+            return new_decision_cache()
+    return new_decision_cache()
 
 
 def save_decision_cache(cache):
+    # The cache is only read by this script, so write it compactly, to a
+    # temp file that is then swapped in: an interrupted write never leaves
+    # a truncated cache behind
+    tmp_path = CACHE_PATH.with_suffix(".tmp")
     try:
-        with CACHE_PATH.open("w", encoding="utf-8") as f:
-            json.dump(cache, f, indent=2)
+        if orjson is not None:
+            payload = orjson.dumps(cache, option=orjson.OPT_SORT_KEYS)
+        else:
+            payload = json.dumps(
+                cache, separators=(",", ":"), sort_keys=True
+            ).encode("utf-8")
+        tmp_path.write_bytes(payload)
+        os.replace(tmp_path, CACHE_PATH)
     except Exception as e:
         print(f"Warning: could not save cache file: {e}")
 
 
+def cached_keep_ids(cache):
+    """Return the set of kept track IDs stored in the cache."""
+    blob = cache.get("keep_blob", "")
+    intern = sys.intern
+    # older caches only have the list
+    keep_set = {intern(t) for t in cache.get("keep", [])}
+    keep_set.update(
+        intern(blob[i:i + SPOTIFY_ID_LEN])
+        for i in range(0, len(blob), SPOTIFY_ID_LEN)
+    )
+    return keep_set
+
+
+def store_keep_ids(cache, keep_set):
+    """Write keep_set into the cache; odd-length IDs stay in the list."""
+    ids = sorted(keep_set)
+    cache["keep_blob"] = "".join(t for t in ids if len(t) == SPOTIFY_ID_LEN)
+    cache["keep"] = [t for t in ids if len(t) != SPOTIFY_ID_LEN]
+
+
+# ---------- Input helpers ----------
+
+# Accepted answers for the fixed-choice prompts ("" = default)
+AUTO_CLEANUP_CHOICES = frozenset({"y", "n", "e", ""})
+YEAR_REVIEW_CHOICES = frozenset({"y", "n", "q", ""})
+
+
+def prompt_choice(prompt, valid):
+    """
+    Ask until the (lowercased) answer is one of `valid`.
+    EOFError (Ctrl-D / closed stdin) is left to main(), like any other prompt.
+    """
+    while True:
+        resp = input(prompt).strip().lower()
+        if resp in valid:
+            return resp
+
+
 # ---------- Spotify helpers ----------
 
+def build_spotify_client():
+    """
+    Create the Spotify client on a pooled HTTP session: connections are
+    reused across (concurrent) requests, and rate limits (429) / transient
+    server errors are retried with backoff, honoring Retry-After.
+    """
+    retry = Retry(
+        total=5,
+        backoff_factor=0.3,
+        status_forcelist=(429, 500, 502, 503, 504),
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_SIZE,
+        pool_maxsize=HTTP_POOL_SIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+
+    # Uses environment variables by default; or you can pass client_id etc
+    return spotipy.Spotify(
+        auth_manager=SpotifyOAuth(scope=SCOPE),
+        requests_session=session,
+        requests_timeout=REQUEST_TIMEOUT_SEC,
+    )
+
+
 def extract_playlist_id(s: str) -> str:
     """Accepts a bare ID or a full URL and returns the playlist ID."""
     s = s.strip()
-    if "playlist/" in s:
-        return s.split("playlist/")[1].split("?")[0]
-    return s.split("?")[0]
+    _, sep, rest = s.partition("playlist/")
+    if sep:
+        return rest.partition("?")[0]
+    return s.partition("?")[0]
+
+
+def fetch_all_pages(fetch_page, page_size):
+    """
+    Fetch all items of an offset-paginated endpoint.
+    The first page tells us the total; the remaining pages are requested
+    concurrently and their items are returned in playlist order.
+    """
+    first = fetch_page(0)
+    items = list(first["items"])
+    offsets = range(page_size, first["total"], page_size)
+    if offsets:
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+            for page in pool.map(fetch_page, offsets):
+                items.extend(page["items"])
+    return items
 
 
 def get_all_tracks(sp, playlist_id):
     """Fetch all tracks from a playlist, handling pagination."""
-    items = []
-    results = sp.playlist_items(
-        playlist_id,
-        additional_types=["track"],
-        limit=100,
+    items = fetch_all_pages(
+        lambda offset: sp.playlist_items(
+            playlist_id,
+            fields=TRACK_FIELDS,
+            additional_types=["track"],
+            limit=100,
+            offset=offset,
+        ),
+        100,
     )
-    items.extend(results["items"])
-    while results["next"]:
-        results = sp.next(results)
-        items.extend(results["items"])
+    # Track IDs are looked up in keep_set and the norm cache over and over;
+    # interned on both sides, a hit compares by identity
+    intern = sys.intern
+    for item in items:
+        track = item.get("track")
+        if track is not None and track.get("id"):
+            track["id"] = intern(track["id"])
     return items
 
 
 def get_all_playlists(sp):
     """Fetch all playlists for current user."""
-    playlists = []
-    results = sp.current_user_playlists(limit=50)
-    playlists.extend(results["items"])
-    while results["next"]:
-        results = sp.next(results)
-        playlists.extend(results["items"])
-    return playlists
+    return fetch_all_pages(
+        lambda offset: sp.current_user_playlists(limit=50, offset=offset),
+        50,
+    )
 
 
 def choose_playlist_interactively(sp):
@@ -106,24 +267,102 @@ def choose_playlist_interactively(sp):
         public_flag = "public" if pl.get("public") else "private"
         print(f"{idx:2d}. {name} ({tracks_total} tracks, {public_flag})")
 
+    # Menu answer ("1", "2", ...) -> playlist ID
+    choices = {str(idx): pl["id"] for idx, pl in enumerate(owned, start=1)}
+
     while True:
         choice = input(
             "\nEnter the playlist number to edit or 'q' to quit: "
         ).strip().lower()
         if choice == "q":
             return None
-        if not choice.isdigit():
-            print("Please enter a valid number.")
-            continue
-        num = int(choice)
-        if not (1 <= num <= len(owned)):
-            print("Number out of range.")
+        playlist_id = choices.get(choice)
+        if playlist_id is None:
+            print(f"Please enter a number between 1 and {len(owned)}.")
             continue
-        return owned[num - 1]["id"]
+        return playlist_id
 
 
 # ---------- Normalization helpers ----------
 
+# Substrings that mark a (...) or [...] group as a title variant qualifier
+QUALIFIER_TOKENS = (
+    "remaster", "reissue", "version", "edit", "mix", "mono", "stereo", "single",
+)
+
+# Words that, right after a " - ", mark the rest of the title as a qualifier
+QUALIFIER_WORDS = (
+    "remastered", "remaster", "reissue", "version", "edit", "mix", "remix",
+    "mono", "stereo", "single", "radio edit", "album version",
+)
+
+# En/em dashes -> plain "-", applied in a single translate() pass
+DASH_TABLE = str.maketrans({"–": "-", "—": "-"})
+
+
+def strip_qualifier_groups(name: str, open_c: str, close_c: str) -> str:
+    """
+    Remove every open_c...close_c group whose content contains a qualifier
+    token, together with the whitespace in front of it:
+    "song (2009 remaster)" -> "song", "song [live]" stays as is.
+    """
+    pos = name.find(open_c)
+    if pos == -1:
+        return name
+
+    parts = []
+    start = 0
+    while pos != -1:
+        end = name.find(close_c, pos + 1)
+        if end == -1:
+            break
+        inner = name[pos + 1:end]
+        if any(tok in inner for tok in QUALIFIER_TOKENS):
+            parts.append(name[start:pos].rstrip())
+            start = end + 1
+            pos = name.find(open_c, start)
+        else:
+            pos = name.find(open_c, pos + 1)
+    parts.append(name[start:])
+    return "".join(parts)
+
+
+def starts_with_qualifier(s: str) -> bool:
+    """True if s starts with a whole qualifier word ("remix", not "remixed")."""
+    for word in QUALIFIER_WORDS:
+        if s.startswith(word):
+            nxt = s[len(word):len(word) + 1]
+            if not (nxt.isalnum() or nxt == "_"):
+                return True
+    return False
+
+
+def strip_dash_qualifier(name: str) -> str:
+    """
+    Cut the title at the first dash followed by an optional year and a
+    qualifier word: " - Remastered", " - 2011 Remaster", " - 2025 version".
+    """
+    pos = name.find("-")
+    while pos != -1:
+        rest = name[pos + 1:].lstrip()
+        if len(rest) >= 4 and rest[:4].isdecimal():
+            rest = rest[4:].lstrip()
+        if starts_with_qualifier(rest):
+            return name[:pos].rstrip()
+        pos = name.find("-", pos + 1)
+    return name
+
+
+def strip_dash_year(name: str) -> str:
+    """Remove a bare trailing year: "song - 2025" -> "song"."""
+    head, sep, tail = name.rpartition("-")
+    tail = tail.lstrip()
+    if sep and len(tail) == 4 and tail.isdecimal():
+        return head.rstrip()
+    return name
+
+
+@lru_cache(maxsize=8192)
 def normalize_title(name: str) -> str:
     """
     Normalize track title for duplicate grouping:
@@ -132,69 +371,170 @@ def normalize_title(name: str) -> str:
     - strip common 'remaster / reissue / version / edit / mix' qualifiers
     - clean extra spaces
     """
-    name = name.lower()
-    name = name.replace("–", "-").replace("—", "-")
-    name = re.sub(r"\s+", " ", name).strip()
+    name = name.lower().translate(DASH_TABLE)
+    name = " ".join(name.split())  # collapse whitespace runs, trim ends
 
-    qualifier_words = (
-        r"remaster(ed)?|reissue|version|edit|mix|remix|mono|stereo|single|"
-        r"radio edit|album version"
-    )
+    # Fast path: every qualifier sits in (...), [...] or after a dash, and
+    # most titles have none of those characters
+    if "-" not in name and "(" not in name and "[" not in name:
+        return name
 
-    # (Remastered), (2025 Reissue), etc.
-    name = re.sub(rf"\s*\(([^)]*({qualifier_words})[^)]*)\)", "", name)
-    # [Remastered], [2025 Version], etc.
-    name = re.sub(rf"\s*\[([^\]]*({qualifier_words})[^\]]*)\]", "", name)
-    # " - Remastered", " - 2011 Remaster", " - 2025 version"
-    name = re.sub(rf"\s*-\s*(\d{{4}}\s*)?({qualifier_words})\b.*$", "", name)
-    # bare " - 2025"
-    name = re.sub(r"\s*-\s*\d{4}\b$", "", name)
+    name = strip_qualifier_groups(name, "(", ")")
+    name = strip_qualifier_groups(name, "[", "]")
+    name = strip_dash_qualifier(name)
+    name = strip_dash_year(name)
 
-    name = re.sub(r"\s+", " ", name).strip(" -")
-    return name
+    # Whitespace was collapsed above and the helpers never leave a double
+    # space behind, so trimming the ends is all that is left to do
+    return name.strip(" -")
 
 
+@lru_cache(maxsize=8192)
 def normalize_artist(name: str) -> str:
     """Normalize main artist name for duplicate grouping."""
     return name.lower().strip()
 
 
-# ---------- Duplicates commit helper ----------
+# ---------- Duplicate grouping ----------
+
+# One playlist entry of a duplicate group, with the fields shown in review
+DuplicateEntry = namedtuple(
+    "DuplicateEntry",
+    [
+        "playlist_index",  # 0-based index in playlist
+        "title",
+        "artists",
+        "album_name",
+        "release_date",
+        "year_str",
+        "uri",
+        "duration_ms",
+        "duration_str",
+        "track_id",
+    ],
+)
+
 
-def commit_duplicate_removals(sp, playlist_id, dup_removals, ask_confirm=True):
+def duplicate_entry(index, track):
+    """Build the review record for one playlist entry of a duplicate group."""
+    title, track_id, uri, album = (
+        track["name"], track["id"], track["uri"], track["album"]
+    )
+    artists_list = [a["name"] for a in track["artists"]]
+
+    album_name = album["name"]
+    release_date = album.get("release_date") or "unknown"
+    if release_date[:4].isdigit():
+        year_str = release_date[:4]
+    else:
+        year_str = "????"
+
+    dur_ms = track.get("duration_ms") or 0
+    total_sec = dur_ms // 1000
+    mins = total_sec // 60
+    secs = total_sec % 60
+    duration_str = f"{mins}:{secs:02d}"
+
+    return DuplicateEntry(
+        playlist_index=index,
+        title=title,
+        artists=artists_list,
+        album_name=album_name,
+        release_date=release_date,
+        year_str=year_str,
+        uri=uri,
+        duration_ms=dur_ms,
+        duration_str=duration_str,
+        track_id=track_id,
+    )
+
+
+def build_duplicate_groups(tracks, norm_cache, skip=()):
     """
-    Remove specific occurrences of duplicate tracks.
+    Group playlist entries by normalized title + main artist.
+    Returns {(norm_title, norm_artist): [entry, ...]} with only the groups
+    that have 2+ entries, in playlist order; each entry is a DuplicateEntry.
+
+    norm_cache maps track ID -> [norm_title, norm_artist] and is persisted
+    in the cache file, so known tracks are not normalized again; new track
+    IDs are added to it. Playlist positions in `skip` are left out.
+    """
+    # First pass: only the grouping key per track, kept in parallel arrays
+    # (keys[i] belongs to playlist position positions[i]; positions are
+    # stored unboxed as C ints)
+    keys = []
+    positions = array("i")
+    # Local aliases: this loop runs once per playlist entry
+    add_key = keys.append
+    add_position = positions.append
+    cached_norm = norm_cache.get
+
+    for index, item in enumerate(tracks):
+        track = item["track"]
+        if track is None or index in skip:
+            continue
+
+        track_id = track["id"]
+        cached = cached_norm(track_id) if track_id else None
+        if cached:
+            key = tuple(cached)
+        else:
+            name, artists = track["name"], track["artists"]
+            main_artist = artists[0]["name"] if artists else "Unknown"
+            key = (normalize_title(name), normalize_artist(main_artist))
+            if track_id:
+                norm_cache[track_id] = list(key)
+
+        add_key(key)
+        add_position(index)
+
+    # Second pass: build entries only for keys seen 2+ times. Walking the
+    # playlist in order keeps groups (and entries) in playlist order.
+    counts = Counter(keys)
+    groups = {}
+    for key, index in zip(keys, positions):
+        if counts[key] > 1:
+            groups.setdefault(key, []).append(
+                duplicate_entry(index, tracks[index]["track"])
+            )
+    return groups
+
+
+# ---------- Removal helpers ----------
+
+def mark_duplicate_removals(dup_removals, pending, ask_confirm=True):
+    """
+    Queue specific occurrences of duplicate tracks for removal.
     dup_removals entries must have:
       - "track_id": Spotify track ID (not full URI)
       - "position": playlist index (0-based)
 
-    Returns True if something was actually removed.
+    Accepted entries are added to `pending` ({position: track_id}); nothing
+    is sent to Spotify until commit_removals() runs at the end.
+
+    Returns the set of playlist positions that were queued (empty if
+    nothing was queued).
     """
     if not dup_removals:
         print("No duplicates selected for removal.")
-        return False
+        return set()
 
-    # Filter & group by track_id
-    items_map = defaultdict(list)
-    skipped = 0
-
-    for e in dup_removals:
-        track_id = e.get("track_id")
-        pos = e.get("position")
-        if track_id is None:
-            skipped += 1
-            continue
-        items_map[track_id].append(pos)
+    # Filter out entries without a track_id (grouping happens at commit time)
+    valid = [
+        (e.get("position"), e["track_id"])
+        for e in dup_removals
+        if e.get("track_id") is not None
+    ]
+    skipped = len(dup_removals) - len(valid)
 
-    if not items_map:
+    if not valid:
         print("Nothing valid to remove (all candidates had no track_id).")
-        return False
+        return set()
 
     if skipped:
         print(f"(Skipped {skipped} entries without a valid track_id – likely local/unsupported tracks.)")
 
-    occurrences_count = sum(len(v) for v in items_map.values())
-    print(f"\nDuplicate occurrences selected for removal: {occurrences_count}")
+    print(f"\nDuplicate occurrences selected for removal: {len(valid)}")
 
     if ask_confirm:
         confirm = input(
@@ -202,34 +542,64 @@ def commit_duplicate_removals(sp, playlist_id, dup_removals, ask_confirm=True):
         ).strip().lower()
         if confirm != "y":
             print("Duplicate removal aborted.")
-            return False
+            return set()
+
+    pending.update(valid)
+    marked = {pos for pos, _ in valid}
+    print("Duplicate occurrences marked for removal.\n")
+    return marked
+
+
+def commit_removals(sp, playlist_id, pending, snapshot_id):
+    """
+    Remove every queued occurrence ({position: track_id}) from the playlist.
+
+    Positions refer to the playlist as loaded at the start, so all requests
+    are made against that snapshot_id; Spotify resolves them against that
+    version, no matter how earlier batches shifted the playlist.
+    """
+    if not pending:
+        print("\nNo changes to apply to the playlist.")
+        return
+
+    # Group positions by track_id with one sort and a linear scan
+    # (highest positions first within each track)
+    ordered = sorted(pending.items(), key=lambda p: (p[1], -p[0]))
 
     # Build payload and send in batches of <= 100 items
     items_payload = [
-        {"uri": track_id, "positions": positions}
-        for track_id, positions in items_map.items()
+        {"uri": track_id, "positions": [pos for pos, _ in occurrences]}
+        for track_id, occurrences in groupby(ordered, key=itemgetter(1))
     ]
 
     max_per_request = 100
     total_items = len(items_payload)
-    num_batches = (total_items + max_per_request - 1) // max_per_request
+    batches = [
+        items_payload[start:start + max_per_request]
+        for start in range(0, total_items, max_per_request)
+    ]
 
-    print(f"Removing {total_items} track IDs in {num_batches} batch(es)...")
+    print(
+        f"\nRemoving {len(pending)} occurrence(s) of {total_items} track IDs "
+        f"in {len(batches)} batch(es)..."
+    )
 
     try:
-        for start in range(0, total_items, max_per_request):
-            batch = items_payload[start:start + max_per_request]
-            sp.playlist_remove_specific_occurrences_of_items(playlist_id, batch)
-        print("Duplicate occurrences removed.\n")
-        return True
+        with ThreadPoolExecutor(max_workers=REMOVE_WORKERS) as pool:
+            list(pool.map(
+                lambda batch: sp.playlist_remove_specific_occurrences_of_items(
+                    playlist_id, batch, snapshot_id=snapshot_id
+                ),
+                batches,
+            ))
+        print("Done. Playlist updated.")
     except spotipy.SpotifyException as e:
-        print("Error while removing duplicates:", e)
-        return False
+        print("Error while removing tracks:", e)
 
 
 # ---------- Automatic duplicate cleanup (duration-based) ----------
 
-def auto_duplicates_step(sp, playlist_id, tracks, keep_set):
+def auto_duplicates_step(groups, keep_set, pending):
     """
     Optional automatic duplicate cleanup:
     - Groups by normalized title + main artist.
@@ -239,70 +609,28 @@ def auto_duplicates_step(sp, playlist_id, tracks, keep_set):
         y  -> delete them all (keep first instance in group)
         n  -> skip auto cleanup, go to manual
         e  -> exclude specific rows from the auto-delete list
+
+    Returns the set of playlist positions queued in `pending` (empty if
+    nothing was queued).
     """
     threshold_ms = DUP_DURATION_THRESHOLD_SEC * 1000
 
-    groups = defaultdict(list)
-
-    for index, item in enumerate(tracks):
-        track = item["track"]
-        if track is None:
-            continue
-
-        title = track["name"]
-        track_id = track["id"]
-        artists_list = [a["name"] for a in track["artists"]]
-        main_artist = artists_list[0] if artists_list else "Unknown"
-
-        key = (normalize_title(title), normalize_artist(main_artist))
-
-        album = track["album"]
-        album_name = album["name"]
-        release_date = album.get("release_date") or "unknown"
-        if release_date and release_date[:4].isdigit():
-            year_str = release_date[:4]
-        else:
-            year_str = "????"
-
-        dur_ms = track.get("duration_ms") or 0
-        total_sec = dur_ms // 1000
-        mins = total_sec // 60
-        secs = total_sec % 60
-        duration_str = f"{mins}:{secs:02d}"
-
-        groups[key].append(
-            {
-                "playlist_index": index,
-                "title": title,
-                "artists": artists_list,
-                "album_name": album_name,
-                "release_date": release_date,
-                "year_str": year_str,
-                "uri": track["uri"],
-                "duration_ms": dur_ms,
-                "duration_str": duration_str,
-                "track_id": track_id,
-            }
-        )
-
     # Build list of auto-candidates: entries to delete, with their base track
     auto_candidates = []
 
+    # build_duplicate_groups only returns groups with 2+ entries
     for key, entries in groups.items():
-        if len(entries) < 2:
-            continue
-
-        sorted_entries = sorted(entries, key=lambda e: e["playlist_index"])
+        sorted_entries = sorted(entries, key=lambda e: e.playlist_index)
         base = sorted_entries[0]
-        base_dur = base["duration_ms"]
+        base_dur = base.duration_ms
 
         if base_dur <= 0:
             continue
 
         for e in sorted_entries[1:]:
-            if e["duration_ms"] <= 0:
+            if e.duration_ms <= 0:
                 continue
-            if abs(e["duration_ms"] - base_dur) <= threshold_ms:
+            if abs(e.duration_ms - base_dur) <= threshold_ms:
                 auto_candidates.append({"entry": e, "base": base})
 
     if not auto_candidates:
@@ -310,7 +638,7 @@ def auto_duplicates_step(sp, playlist_id, tracks, keep_set):
             f"No candidates found for automatic duplicate cleanup "
             f"within ±{DUP_DURATION_THRESHOLD_SEC} seconds.\n"
         )
-        return False  # playlist not changed
+        return set()  # nothing queued
 
     # Compute column widths so columns line up nicely
     col1_w = 0  # title – artists
@@ -322,16 +650,14 @@ def auto_duplicates_step(sp, playlist_id, tracks, keep_set):
         e = c["entry"]
         b = c["base"]
 
-        cand_artists = ", ".join(e["artists"])
-        base_artists = ", ".join(b["artists"])
-
-        cand_col1 = f"{e['title']} – {cand_artists}"
-        base_col1 = f"{b['title']} – {base_artists}"
+        # Keep the "title – artists" strings for the print loop below
+        cand_col1 = c["cand_col1"] = f"{e.title} – {', '.join(e.artists)}"
+        base_col1 = c["base_col1"] = f"{b.title} – {', '.join(b.artists)}"
 
         col1_w = max(col1_w, len(cand_col1), len(base_col1))
-        col2_w = max(col2_w, len(e["album_name"]), len(b["album_name"]))
-        col3_w = max(col3_w, len(e["release_date"]), len(b["release_date"]))
-        col4_w = max(col4_w, len(e["duration_str"]), len(b["duration_str"]))
+        col2_w = max(col2_w, len(e.album_name), len(b.album_name))
+        col3_w = max(col3_w, len(e.release_date), len(b.release_date))
+        col4_w = max(col4_w, len(e.duration_str), len(b.duration_str))
 
 
     # Show summary
@@ -345,47 +671,45 @@ def auto_duplicates_step(sp, playlist_id, tracks, keep_set):
         "the 'kept as:' line shows the track that will be KEPT.\n"
     )
 
+    # Collect all rows and write them at once instead of a print() per line
+    lines = []
     for idx, c in enumerate(auto_candidates, start=1):
         e = c["entry"]
         b = c["base"]  # base track to keep
 
-        cand_artists = ", ".join(e["artists"])
-        base_artists = ", ".join(b["artists"])
-
         # Build padded columns for the candidate
-        cand_col1 = f"{e['title']} – {cand_artists}".ljust(col1_w)
-        cand_col2 = e["album_name"].ljust(col2_w)
-        cand_col3 = e["release_date"].ljust(col3_w)
-        cand_col4 = e["duration_str"].ljust(col4_w)
+        cand_col1 = c["cand_col1"].ljust(col1_w)
+        cand_col2 = e.album_name.ljust(col2_w)
+        cand_col3 = e.release_date.ljust(col3_w)
+        cand_col4 = e.duration_str.ljust(col4_w)
 
         # Build padded columns for the base (kept) track
-        base_col1 = f"{b['title']} – {base_artists}".ljust(col1_w)
-        base_col2 = b["album_name"].ljust(col2_w)
-        base_col3 = b["release_date"].ljust(col3_w)
-        base_col4 = b["duration_str"].ljust(col4_w)
+        base_col1 = c["base_col1"].ljust(col1_w)
+        base_col2 = b.album_name.ljust(col2_w)
+        base_col3 = b.release_date.ljust(col3_w)
+        base_col4 = b.duration_str.ljust(col4_w)
 
-        print(
+        lines.append(
             f"{idx:3d}. original: {cand_col1} | {cand_col2} | {cand_col3} | "
-            f"{cand_col4} (playlist position {e['playlist_index']+1})"
+            f"{cand_col4} (playlist position {e.playlist_index+1})"
         )
-        print(
+        lines.append(
             f"     kept as: {base_col1} | {base_col2} | {base_col3} | "
-            f"{base_col4} (playlist position {b['playlist_index']+1})"
+            f"{base_col4} (playlist position {b.playlist_index+1})"
         )
-
+    lines.append("")
+    sys.stdout.write("\n".join(lines))
 
     # Ask user what to do
-    while True:
-        resp = input(
-            "\nApply this automatic cleanup? "
-            "[y = yes, n = no, e = exclude some rows] "
-        ).strip().lower()
-        if resp in ("y", "n", "e", ""):
-            break
+    resp = prompt_choice(
+        "\nApply this automatic cleanup? "
+        "[y = yes, n = no, e = exclude some rows] ",
+        AUTO_CLEANUP_CHOICES,
+    )
 
     if resp in ("", "n"):
         print("Skipping automatic duplicate cleanup.\n")
-        return False
+        return set()
 
     final_candidates = auto_candidates
 
@@ -407,7 +731,7 @@ def auto_duplicates_step(sp, playlist_id, tracks, keep_set):
                 if not nums:
                     exclude_set = set()
                     break
-                if not all(1 <= n <= len(auto_candidates) for n in nums):
+                if min(nums) < 1 or max(nums) > len(auto_candidates):
                     raise ValueError
                 exclude_set = set(nums)
                 break
@@ -421,7 +745,7 @@ def auto_duplicates_step(sp, playlist_id, tracks, keep_set):
             ]
         if not final_candidates:
             print("No tracks left for automatic deletion. Skipping.\n")
-            return False
+            return set()
 
     # Prepare deletions and mark base tracks as 'kept'
     dup_removals = []
@@ -431,24 +755,22 @@ def auto_duplicates_step(sp, playlist_id, tracks, keep_set):
         e = c["entry"]
         base = c["base"]
         dup_removals.append(
-            {"track_id": e["track_id"], "position": e["playlist_index"]}
+            {"track_id": e.track_id, "position": e.playlist_index}
         )
-        if base["track_id"]:
-            base_ids_to_keep.add(base["track_id"])
+        if base.track_id:
+            base_ids_to_keep.add(base.track_id)
 
-    # Actually delete (no extra confirm here; we already asked)
-    changed = commit_duplicate_removals(
-        sp, playlist_id, dup_removals, ask_confirm=False
-    )
-    if changed:
+    # Queue for removal (no extra confirm here; we already asked)
+    marked = mark_duplicate_removals(dup_removals, pending, ask_confirm=False)
+    if marked:
         for tid in base_ids_to_keep:
             keep_set.add(tid)
-    return changed
+    return marked
 
 
 # ---------- Manual duplicate review ----------
 
-def manual_duplicates_step(sp, playlist_id, tracks, keep_set):
+def manual_duplicates_step(groups, keep_set, pending):
     """
     Manual duplicate review step.
     Behavior:
@@ -456,52 +778,13 @@ def manual_duplicates_step(sp, playlist_id, tracks, keep_set):
       * Enter numbers to KEEP (e.g. '2' or '1,3') -> remove all others.
       * Enter '-2,3' to REMOVE those entries and keep the others.
       * Enter nothing -> keep all.
-      * 'q' -> stop duplicate review and apply removals so far.
-    """
-    groups = defaultdict(list)
-
-    for index, item in enumerate(tracks):
-        track = item["track"]
-        if track is None:
-            continue
+      * 'q' -> stop duplicate review and keep the removals chosen so far.
 
-        title = track["name"]
-        track_id = track["id"]
-        artists_list = [a["name"] for a in track["artists"]]
-        main_artist = artists_list[0] if artists_list else "Unknown"
-        key = (normalize_title(title), normalize_artist(main_artist))
-
-        album = track["album"]
-        album_name = album["name"]
-        release_date = album.get("release_date") or "unknown"
-        if release_date and release_date[:4].isdigit():
-            year_str = release_date[:4]
-        else:
-            year_str = "????"
-
-        dur_ms = track.get("duration_ms") or 0
-        total_sec = dur_ms // 1000
-        mins = total_sec // 60
-        secs = total_sec % 60
-        duration_str = f"{mins}:{secs:02d}"
-
-        groups[key].append(
-            {
-                "playlist_index": index,  # 0-based index in playlist
-                "title": title,
-                "artists": artists_list,
-                "album_name": album_name,
-                "release_date": release_date,
-                "year_str": year_str,
-                "uri": track["uri"],
-                "duration_ms": dur_ms,
-                "duration_str": duration_str,
-                "track_id": track_id,
-            }
-        )
-
-    dup_groups = {k: v for k, v in groups.items() if len(v) > 1}
-    if not dup_groups:
+    Chosen removals are queued in `pending`.
+    """
+    # build_duplicate_groups only returns groups with 2+ entries, so no
+    # filtered copy of `groups` is needed here
+    if not groups:
         print("No obvious duplicates (same song title + main artist).")
         return
 
@@ -516,18 +799,19 @@ def manual_duplicates_step(sp, playlist_id, tracks, keep_set):
         "- Type 'q' to stop duplicate review and move on.\n"
     )
 
-    for (title_norm, artist_norm), entries in dup_groups.items():
-        rep_title = entries[0]["title"]
-        rep_artist = entries[0]["artists"][0] if entries[0]["artists"] else "Unknown"
-        print("-" * 70)
-        print(f"Possible duplicates for: {rep_title} – {rep_artist}")
+    for (title_norm, artist_norm), entries in groups.items():
+        rep_title = entries[0].title
+        rep_artist = entries[0].artists[0] if entries[0].artists else "Unknown"
+        lines = ["-" * 70, f"Possible duplicates for: {rep_title} – {rep_artist}"]
         for i, e in enumerate(entries, start=1):
-            artists_str = ", ".join(e["artists"])
-            print(f" {i}) playlist position {e['playlist_index']+1}")
-            print(f"    {e['title']} – {artists_str}")
-            print(f"    album: {e['album_name']}")
-            print(f"    release: {e['release_date']} (year {e['year_str']})")
-            print(f"    duration: {e['duration_str']}")
+            artists_str = ", ".join(e.artists)
+            lines.append(f" {i}) playlist position {e.playlist_index+1}")
+            lines.append(f"    {e.title} – {artists_str}")
+            lines.append(f"    album: {e.album_name}")
+            lines.append(f"    release: {e.release_date} (year {e.year_str})")
+            lines.append(f"    duration: {e.duration_str}")
+        lines.append("")
+        sys.stdout.write("\n".join(lines))
 
         while True:
             resp = input(
@@ -536,14 +820,14 @@ def manual_duplicates_step(sp, playlist_id, tracks, keep_set):
             ).strip().lower()
 
             if resp == "q":
-                commit_duplicate_removals(sp, playlist_id, dup_removals, ask_confirm=True)
+                mark_duplicate_removals(dup_removals, pending, ask_confirm=True)
                 return
 
             if not resp:
                 # keep all entries in this group, and remember them as kept
                 for e in entries:
-                    if e["track_id"]:
-                        keep_set.add(e["track_id"])
+                    if e.track_id:
+                        keep_set.add(e.track_id)
                 break
 
             # detect remove mode if response starts with '-'
@@ -557,10 +841,10 @@ def manual_duplicates_step(sp, playlist_id, tracks, keep_set):
                 nums = [int(x) for x in s.replace(" ", "").split(",") if x]
                 if not nums:
                     for e in entries:
-                        if e["track_id"]:
-                            keep_set.add(e["track_id"])
+                        if e.track_id:
+                            keep_set.add(e.track_id)
                     break
-                if not all(1 <= n <= len(entries) for n in nums):
+                if min(nums) < 1 or max(nums) > len(entries):
                     raise ValueError
             except ValueError:
                 print("Invalid input. Please enter valid numbers from the list.")
@@ -573,78 +857,96 @@ def manual_duplicates_step(sp, playlist_id, tracks, keep_set):
                 for idx_e, e in enumerate(entries, start=1):
                     if idx_e in selected:
                         dup_removals.append(
-                            {"track_id": e["track_id"], "position": e["playlist_index"]}
+                            {"track_id": e.track_id, "position": e.playlist_index}
                         )
                     else:
-                        if e["track_id"]:
-                            keep_set.add(e["track_id"])
+                        if e.track_id:
+                            keep_set.add(e.track_id)
             else:
                 # KEEP only the selected entries -> remove all others
                 for idx_e, e in enumerate(entries, start=1):
                     if idx_e in selected:
-                        if e["track_id"]:
-                            keep_set.add(e["track_id"])
+                        if e.track_id:
+                            keep_set.add(e.track_id)
                     else:
                         dup_removals.append(
-                            {"track_id": e["track_id"], "position": e["playlist_index"]}
+                            {"track_id": e.track_id, "position": e.playlist_index}
                         )
 
             break
 
-    commit_duplicate_removals(sp, playlist_id, dup_removals, ask_confirm=True)
+    mark_duplicate_removals(dup_removals, pending, ask_confirm=True)
 
 
-def handle_duplicates(sp, playlist_id, tracks, keep_set):
+def handle_duplicates(tracks, keep_set, norm_cache, pending):
     """
     Orchestrates duplicate handling:
     1. Optional automatic duration-based cleanup.
-    2. Then manual duplicate review on the updated playlist.
+    2. Then manual duplicate review of what is left.
+    Removals are queued in `pending` ({position: track_id}).
     """
+    groups = build_duplicate_groups(tracks, norm_cache, pending)
+
     # Step 1: optional automatic cleanup
-    changed = auto_duplicates_step(sp, playlist_id, tracks, keep_set)
+    marked = auto_duplicates_step(groups, keep_set, pending)
 
-    # Step 2: manual review, possibly on updated playlist
-    if changed:
-        tracks = get_all_tracks(sp, playlist_id)
-    manual_duplicates_step(sp, playlist_id, tracks, keep_set)
+    # Step 2: manual review; entries already queued are left out
+    if marked:
+        groups = build_duplicate_groups(tracks, norm_cache, pending)
+    manual_duplicates_step(groups, keep_set, pending)
 
 
 # ---------- Year-based filtering ----------
 
-def review_tracks_by_year(sp, playlist_id, tracks, cutoff_year, keep_set):
+def release_year(album):
+    """Album release year as an int, or None if Spotify has no usable date."""
+    year_str = (album.get("release_date") or "")[:4]
+    return int(year_str) if year_str.isdigit() else None
+
+
+def review_tracks_by_year(tracks, cutoff_year, keep_set, pending):
+    """
+    Let the user review tracks from albums after the cutoff year.
+    Every occurrence of a track chosen for deletion is queued in `pending`
+    ({position: track_id}); tracks already queued are not shown.
+    """
     print(
         f"\n=== Year-based cleanup (albums after {cutoff_year}) ===\n"
         f"Only tracks whose album year is > {cutoff_year} (or unknown) will be shown.\n"
     )
 
-    to_remove_uris = []
-
+    # First pass (no prompting): keep only tracks released after the cutoff
+    # or with an unknown year; albums clearly released on/before the cutoff
+    # year, tracks we already decided to keep and queued removals are skipped
+    candidates = []
     for idx, item in enumerate(tracks, start=1):
         track = item["track"]
-        if track is None:
+        if track is None or track["id"] in keep_set or idx - 1 in pending:
             continue
+        year = release_year(track["album"])
+        if year is None or year > cutoff_year:
+            candidates.append((idx, track, year))
 
+    to_remove_uris = set()  # the same track can appear twice
+
+    for idx, track, year in candidates:
         track_id = track["id"]
-        # Skip tracks we already decided to keep in a previous run
-        if track_id in keep_set:
+        uri = track["uri"]
+        # Decided earlier in this review: kept, or marked for removal
+        # (which removes every occurrence anyway)
+        if track_id in keep_set or uri in to_remove_uris:
             continue
 
+        album = track["album"]
+        release_date = album.get("release_date") or "unknown"
+        year_str = "????" if year is None else release_date[:4]
+
+        # Only tracks that are actually shown get their strings built
         track_name = track["name"]
         artists = ", ".join(a["name"] for a in track["artists"])
-        album = track["album"]
         album_name = album["name"]
-        release_date = album.get("release_date") or "unknown"
         precision = album.get("release_date_precision", "day")
 
-        if release_date and release_date[:4].isdigit():
-            year_str = release_date[:4]
-        else:
-            year_str = "????"
-
-        # Auto-keep albums clearly released on/before the cutoff year
-        if year_str != "????" and int(year_str) <= cutoff_year:
-            continue
-
         print("-" * 70)
         print(f"{idx}. {track_name} – {artists}")
         print(f"   Album: {album_name}")
@@ -658,28 +960,23 @@ def review_tracks_by_year(sp, playlist_id, tracks, cutoff_year, keep_set):
             f"{cutoff_year+1}, you can choose to keep it.)"
         )
 
-        while True:
-            choice = input(
-                "Delete this track from the playlist? "
-                "[y = delete, n = keep, q = quit] "
-            ).strip().lower()
-            if choice in ("y", "n", "q", ""):
-                break
+        choice = prompt_choice(
+            "Delete this track from the playlist? "
+            "[y = delete, n = keep, q = quit] ",
+            YEAR_REVIEW_CHOICES,
+        )
 
         if choice == "q":
             print("Stopping year-based review.")
             break
         elif choice == "y":
-            to_remove_uris.append(track["uri"])
+            to_remove_uris.add(uri)
         else:
             # default / 'n' / ''  -> keep track and remember that decision
             if track_id:
                 keep_set.add(track_id)
             continue
 
-    # Deduplicate URIs (just in case)
-    to_remove_uris = list(dict.fromkeys(to_remove_uris))
-
     print("\nSummary (year-based):")
     print(f"Tracks marked for removal: {len(to_remove_uris)}")
 
@@ -694,12 +991,20 @@ def review_tracks_by_year(sp, playlist_id, tracks, cutoff_year, keep_set):
         print("Year-based removal aborted.")
         return
 
-    # Spotify API lets you remove up to 100 items per call
-    for i in range(0, len(to_remove_uris), 100):
-        batch = to_remove_uris[i : i + 100]
-        sp.playlist_remove_all_occurrences_of_items(playlist_id, batch)
+    # Queue every occurrence of the chosen tracks
+    skipped = 0
+    for index, item in enumerate(tracks):
+        track = item["track"]
+        if track is None or track["uri"] not in to_remove_uris:
+            continue
+        if track["id"] is None:
+            skipped += 1
+            continue
+        pending[index] = track["id"]
 
-    print("Done. Year-based removals applied.")
+    if skipped:
+        print(f"(Skipped {skipped} entries without a valid track_id – likely local/unsupported tracks.)")
+    print("Year-based removals marked.")
 
 
 def ask_cutoff_year():
@@ -723,13 +1028,8 @@ def ask_cutoff_year():
 
 # ---------- Main ----------
 
-def main():
-    # Uses environment variables by default; or you can pass client_id etc
-    sp = spotipy.Spotify(auth_manager=SpotifyOAuth(scope=SCOPE))
-
-    me = sp.current_user()
-    print(f"Logged in as: {me['display_name']} ({me['id']})")
-
+def refine_playlist(sp, keep_set, norm_cache):
+    """Pick a playlist, review it and apply the confirmed removals."""
     # If user gave playlist URL/ID on the command line, use it.
     # Otherwise show a menu of their playlists.
     if len(sys.argv) > 1:
@@ -741,32 +1041,56 @@ def main():
             print("No playlist selected, exiting.")
             return
 
-    playlist = sp.playlist(playlist_id, fields="name,owner(display_name),id")
+    playlist = sp.playlist(
+        playlist_id, fields="name,owner(display_name),id,snapshot_id"
+    )
     print(
         f"\nLoaded playlist: {playlist['name']} "
         f"(owner: {playlist['owner']['display_name']})"
     )
 
-    # Load cache of previous "keep" decisions
-    decision_cache = load_decision_cache()
-    keep_set = set(decision_cache.get("keep", []))
-
     cutoff_year = ask_cutoff_year()
     print(f"Using cutoff year: {cutoff_year}\n")
 
     tracks = get_all_tracks(sp, playlist_id)
     print(f"Found {len(tracks)} tracks.\n")
 
+    # Removals from both steps are queued here ({position: track_id}) and
+    # applied together at the end
+    pending = {}
+
     # Step 1: duplicates (auto + manual)
-    handle_duplicates(sp, playlist_id, tracks, keep_set)
+    handle_duplicates(tracks, keep_set, norm_cache, pending)
 
-    # Step 2: re-fetch playlist and do year-based cleanup
-    tracks = get_all_tracks(sp, playlist_id)
-    review_tracks_by_year(sp, playlist_id, tracks, cutoff_year, keep_set)
+    # Step 2: year-based cleanup of what is left
+    review_tracks_by_year(tracks, cutoff_year, keep_set, pending)
+
+    # Step 3: apply all queued removals against the snapshot loaded above
+    commit_removals(sp, playlist_id, pending, playlist["snapshot_id"])
+
+
+def main():
+    sp = build_spotify_client()
+
+    me = sp.current_user()
+    print(f"Logged in as: {me['display_name']} ({me['id']})")
+
+    # Load cache of previous "keep" decisions
+    decision_cache = load_decision_cache()
+    keep_set = cached_keep_ids(decision_cache)
 
-    # Save updated keep_set back to cache
-    decision_cache["keep"] = sorted(keep_set)
-    save_decision_cache(decision_cache)
+    # Input ending (Ctrl-D / closed stdin) at any prompt quits the run
+    # before anything is removed; decisions made so far are still saved.
+    # The finally also covers errors (e.g. network failures) raised while
+    # the queued removals are committed at the end
+    try:
+        refine_playlist(sp, keep_set, decision_cache["norm"])
+    except EOFError:
+        print("\nInput closed, exiting without changing the playlist.")
+    finally:
+        # Save updated keep_set (and any new normalized keys) back to cache
+        store_keep_ids(decision_cache, keep_set)
+        save_decision_cache(decision_cache)
 
 
 if __name__ == "__main__":